@@ -1,8 +1,19 @@
 from typing import Any, AsyncGenerator
 
-from httpx import AsyncClient
+from fastapi import Request
+from httpx import AsyncClient, Limits
 
+from app.config import settings
 
-async def get_http_client() -> AsyncGenerator[AsyncClient, Any]:
-    async with AsyncClient(timeout=10.0) as client:
-        yield client
+
+def create_http_client() -> AsyncClient:
+    """Pooled client for the document service, meant to live as long as the process."""
+    return AsyncClient(
+        base_url=settings.DOCUMENT_SERVICE_URL,
+        timeout=30.0,
+        limits=Limits(max_connections=100, max_keepalive_connections=50)
+    )
+
+
+async def get_http_client(request: Request) -> AsyncGenerator[AsyncClient, Any]:
+    yield request.app.state.http_client
@@ -0,0 +1,35 @@
+from typing import Any, AsyncGenerator
+
+from fastapi import Request
+from redis.asyncio import Redis
+
+from app.config import settings
+
+# Seconds a finished analysis is remembered by analyze_document_task
+ANALYZED_DONE_TTL = 3600
+# Seconds a "completed" document status response is served from cache
+DOCUMENT_STATUS_TTL = 60
+
+
+def analyzing_key(doc_id: int) -> str:
+    """Key set by analyze_document_task while it is running for the document"""
+    return f"analyzing:{doc_id}"
+
+
+def analyzed_done_key(doc_id: int) -> str:
+    """Key set once the document's issues are stored in the database"""
+    return f"analyzed:done:{doc_id}"
+
+
+def document_status_key(doc_id: int) -> str:
+    """Cached DocumentAnalysisStatusResponse of an analyzed document"""
+    return f"analyzed:status:{doc_id}"
+
+
+def create_redis_client() -> Redis:
+    """Async client for the Redis instance that also holds Celery results."""
+    return Redis.from_url(settings.CELERY_RESULT_BACKEND)
+
+
+async def get_redis(request: Request) -> AsyncGenerator[Redis, Any]:
+    yield request.app.state.redis
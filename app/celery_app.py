@@ -18,11 +18,15 @@ celery_app.conf.update(
     task_track_started=True,
     task_time_limit=30 * 60,
     task_soft_time_limit=25 * 60,
+    # Long LLM tasks: reserve one message at a time and ack only after the
+    # task finishes, so a crashed worker's task goes back to the queue
     worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
     worker_max_tasks_per_child=1000
 )
 
 celery_app.conf.task_routes = {
-    "app.tasks.analyze_chunks": {"queue": 'chunk_processing'},
+    "app.tasks.analyze_document_task": {"queue": 'chunk_processing'},
     "app.tasks.*": {"queue": 'default'}
 }
@@ -7,6 +7,7 @@ class Settings(BaseSettings):
     CELERY_RESULT_BACKEND: str
     DATABASE_URL: str
     DEBUG: bool = False  # Default value if missing
+    OLLAMA_CONCURRENCY: int = 4  # Max chunks analyzed in parallel per task
 
     class Config:
         env_file = ".env"  # Optional (Pydantic auto-finds .env)
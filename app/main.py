@@ -1,13 +1,30 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.routers import analyzer
-from app.backend.db import init_db
+from app.backend.client_dep import create_http_client
+from app.backend.redis_dep import create_redis_client
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema is managed by Alembic (`alembic upgrade head`), not at startup
+    app.state.http_client = create_http_client()
+    app.state.redis = create_redis_client()
+    try:
+        yield
+    finally:
+        await app.state.http_client.aclose()
+        await app.state.redis.aclose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 origins = [
     "http://localhost:3000",
@@ -26,13 +43,3 @@ app.add_middleware(
 
 
 app.include_router(analyzer.router)
-
-# Rewrite to the current methods
-@app.on_event("startup")
-async def on_startup():
-    logger.info("Initializing database...")
-    try:
-        await init_db()
-        logger.info("Database initialized successfully!")
-    except Exception as e:
-        logger.error(f"Failed to initialize database: {e}")
@@ -0,0 +1,31 @@
+"""add_document_id_index
+
+Revision ID: 3f6c2b8e91d4
+Revises: aa27b5964111
+Create Date: 2026-10-15 10:14:37.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6c2b8e91d4'
+down_revision: Union[str, Sequence[str], None] = 'aa27b5964111'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_analyzed_docs_doc_id_id', 'analyzed_docs', ['document_id', 'id'], unique=False)
+    # The primary key is already indexed
+    op.drop_index(op.f('ix_analyzed_docs_id'), table_name='analyzed_docs')
+    op.execute('ANALYZE analyzed_docs')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(op.f('ix_analyzed_docs_id'), 'analyzed_docs', ['id'], unique=False)
+    op.drop_index('ix_analyzed_docs_doc_id_id', table_name='analyzed_docs')
@@ -20,6 +20,9 @@ depends_on: Union[str, Sequence[str], None] = None
 
 def upgrade() -> None:
     """Upgrade schema."""
+    # Databases bootstrapped by the old create_all startup hook already have it
+    if sa.inspect(op.get_bind()).has_table('analyzed_docs'):
+        return
     # ### commands auto generated by Alembic - please adjust! ###
     op.create_table('analyzed_docs',
     sa.Column('id', sa.Integer(), nullable=False),
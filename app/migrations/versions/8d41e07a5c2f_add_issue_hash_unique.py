@@ -0,0 +1,38 @@
+"""add_issue_hash_unique
+
+Revision ID: 8d41e07a5c2f
+Revises: 3f6c2b8e91d4
+Create Date: 2026-10-15 12:03:51.718264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41e07a5c2f'
+down_revision: Union[str, Sequence[str], None] = '3f6c2b8e91d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('analyzed_docs', sa.Column('issue_hash', sa.BigInteger(), nullable=True))
+    # Same value as app.models.analyzed_doc.hash_issue
+    op.execute("UPDATE analyzed_docs SET issue_hash = ('x' || left(md5(issue), 16))::bit(64)::bigint")
+    # Keep the oldest row of every duplicated finding
+    op.execute(
+        "DELETE FROM analyzed_docs a USING analyzed_docs b "
+        "WHERE a.document_id = b.document_id AND a.issue_hash = b.issue_hash AND a.id > b.id"
+    )
+    op.alter_column('analyzed_docs', 'issue_hash', nullable=False)
+    op.create_unique_constraint('uq_doc_issue', 'analyzed_docs', ['document_id', 'issue_hash'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_doc_issue', 'analyzed_docs', type_='unique')
+    op.drop_column('analyzed_docs', 'issue_hash')
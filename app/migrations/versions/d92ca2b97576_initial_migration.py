@@ -20,6 +20,9 @@ depends_on: Union[str, Sequence[str], None] = None
 
 def upgrade() -> None:
     """Upgrade schema."""
+    # analyzed_docs is already created by 50167cd3e6c7
+    if sa.inspect(op.get_bind()).has_table('analyzed_docs'):
+        return
     # ### commands auto generated by Alembic - please adjust! ###
     op.create_table('analyzed_docs',
     sa.Column('id', sa.Integer(), nullable=False),
@@ -34,7 +37,5 @@ def upgrade() -> None:
 
 def downgrade() -> None:
     """Downgrade schema."""
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_index(op.f('ix_analyzed_docs_id'), table_name='analyzed_docs')
-    op.drop_table('analyzed_docs')
-    # ### end Alembic commands ###
+    # Nothing to undo, 50167cd3e6c7 owns analyzed_docs
+    pass
@@ -1,6 +1,7 @@
+import hashlib
 from typing import Literal
 
-from sqlalchemy import Integer, Text, String
+from sqlalchemy import BigInteger, Integer, Text, String, Index, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.backend.db import Base
@@ -8,11 +9,27 @@ from app.backend.db import Base
 SeverityStages = Literal['critical', 'minor', 'ignore']
 
 
+def hash_issue(issue: str) -> int:
+    """Signed 64-bit prefix of the MD5 of the issue text.
+
+    Matches ('x' || left(md5(issue), 16))::bit(64)::bigint in Postgres.
+    """
+    return int.from_bytes(hashlib.md5(issue.encode()).digest()[:8], 'big', signed=True)
+
+
 class AnalyzedDocIssues(Base):
     """All analyzed issues"""
     __tablename__ = 'analyzed_docs'
+    __table_args__ = (
+        # Every query filters by document_id and the result pages are keyed by id;
+        # the per-document COUNT(*) needs nothing else from the row
+        Index('ix_analyzed_docs_doc_id_id', 'document_id', 'id'),
+        # Lets repeated inserts of the same finding be skipped with ON CONFLICT
+        UniqueConstraint('document_id', 'issue_hash', name='uq_doc_issue'),
+    )
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
     document_id: Mapped[int] = mapped_column(Integer, nullable=False)
     issue: Mapped[str] = mapped_column(Text, nullable=False)
+    issue_hash: Mapped[int] = mapped_column(BigInteger, nullable=False)
     severity: Mapped[SeverityStages] = mapped_column(String(8), nullable=False)
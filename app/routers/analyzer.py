@@ -1,12 +1,19 @@
+import asyncio
 from typing import Annotated
-from typing import Literal
+from typing import Literal, get_args
 
+import orjson
 from celery.result import AsyncResult
-from fastapi import APIRouter, Path, Query, Depends, logger
-from sqlalchemy import select, func, case
+from fastapi import APIRouter, Path, Query, Depends, HTTPException, WebSocket, WebSocketDisconnect, logger
+from fastapi.responses import StreamingResponse
+from redis.asyncio import Redis
+from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.backend.db import async_session_maker
 from app.backend.db_depends import get_db
+from app.backend.redis_dep import analyzing_key, document_status_key, get_redis, DOCUMENT_STATUS_TTL
+from app.celery_app import celery_app
 from app.models.analyzed_doc import AnalyzedDocIssues
 from app.schemas.analyzer import *
 from app.tasks import analyze_document_task
@@ -14,14 +21,38 @@ from app.tasks import analyze_document_task
 router = APIRouter(prefix='/analyze', tags=['analyzer'])
 
 AllowedLanguage = Literal['ru', 'en']
+# Checked by hand on the hot POST path; the Literal still documents the enum
+ALLOWED_LANGUAGES = frozenset(get_args(AllowedLanguage))
+
+# Plain column rows are returned by the result endpoints, no ORM objects are built
+ISSUE_COLUMNS = (
+    AnalyzedDocIssues.id,
+    AnalyzedDocIssues.document_id,
+    AnalyzedDocIssues.issue,
+    AnalyzedDocIssues.severity
+)
+
+# Sample issue prefixes in the document status, other severities show as minor
+SEVERITY_PREFIXES = {'critical': 'CRITICAL: ', 'major': 'MAJOR: '}
+
+# Task states after which the status websocket is closed
+TERMINAL_TASK_STATES = frozenset({'SUCCESS', 'FAILURE'})
+# Seconds the status websocket waits for a published update before re-reading the state
+STATUS_RECHECK_INTERVAL = 5.0
+# Longest a status websocket stays open, unknown task ids stay PENDING forever
+STATUS_WS_MAX_DURATION = celery_app.conf.task_time_limit
 
 
 @router.post('/{doc_id}', status_code=202, summary='Run document analysis', response_model=AnalysisStatusResponse)
 async def analyze_doc(
         doc_id: Annotated[int, Path(ge=0)],
-        language: Annotated[AllowedLanguage, Query(..., title='Language', description="Select 'ru' or 'en'")],
+        language: Annotated[str, Query(..., title='Language', description="Select 'ru' or 'en'",
+                                       json_schema_extra={'enum': list(get_args(AllowedLanguage))})],
         retry: bool = False
 ):
+    if language not in ALLOWED_LANGUAGES:
+        raise HTTPException(status_code=422, detail="language must be 'ru' or 'en'")
+
     # Запускаем задачу в Celery
     task = analyze_document_task.delay(doc_id, language, retry)
 
@@ -37,8 +68,7 @@ async def analyze_doc(
             summary='Get analysis task status',
             response_model=TaskStatusResponse)
 async def get_task_status(
-        task_id: str = Path(..., description="ID задачи анализа"),
-        db: AsyncSession = Depends(get_db)
+        task_id: str = Path(..., description="ID задачи анализа")
 ):
     """
     Проверяет статус задачи анализа документа.
@@ -48,15 +78,15 @@ async def get_task_status(
     - Информацию об ошибке (если задача завершилась с ошибкой)
     """
     task_result = AsyncResult(task_id)
-    response_data = {
-        "task_id": task_id,
-        "task_status": task_result.status,
-        "document_id": None,
-        "analysis_result": None,
-        "issues_found": None,
-        "progress": 0,
-        "error": None
-    }
+    response = TaskStatusResponse(
+        task_id=task_id,
+        task_status=task_result.status,
+        document_id=None,
+        analysis_result=None,
+        issues_found=None,
+        progress=0,
+        error=None
+    )
 
     # Task completed successfully
     if task_result.successful():
@@ -64,46 +94,94 @@ async def get_task_status(
 
         # Ensure we have the document_id
         doc_id = result.get("document_id")
-        response_data["document_id"] = doc_id
+        response.document_id = doc_id
 
         # Handle different completion states
         if result.get("analysis_result") == "completed_no_issues":
-            response_data.update({
-                "analysis_result": "completed",
-                "issues_found": False,
-                "progress": 100
-            })
+            response.analysis_result = "completed"
+            response.issues_found = False
+            response.progress = 100
         elif result.get("analysis_result") in ("completed_with_issues", "completed_with_issues_and_failed_to_inserted"):
-            # Only query DB if we're sure the task is fully complete
+            # The task counts the document's rows in its insert transaction
             if result.get("progress") == 100:
-                issues_count = await db.scalar(
-                    select(func.count(AnalyzedDocIssues.id))
-                    .where(AnalyzedDocIssues.document_id == doc_id)
-                )
-                response_data.update({
-                    "analysis_result": "completed",
-                    "issues_found": issues_count > 0,
-                    "progress": 100,
-                    "issues_count": issues_count
-                })
+                issues_count = result.get("stored_issues", result.get("inserted_issues", 0))
+                response.analysis_result = "completed"
+                response.issues_found = issues_count > 0
+                response.issues_count = issues_count
+                response.progress = 100
             else:
                 # Task is still processing issues
-                response_data.update({
-                    "analysis_result": "processing",
-                    "progress": result.get("progress", 0)
-                })
+                response.analysis_result = "processing"
+                response.progress = result.get("progress", 0)
 
     # Task failed
     elif task_result.failed():
-        error_info = str(task_result.result)
-        response_data.update({
-            "analysis_result": "failed",
-            "error": error_info,
-            "progress": 100,
-            "issues_found": False
-        })
+        response.analysis_result = "failed"
+        response.error = str(task_result.result)
+        response.progress = 100
+        response.issues_found = False
+
+    # Task is running and reports its progress via update_state
+    elif task_result.status == 'PROGRESS':
+        meta = task_result.info or {}
+        response.document_id = meta.get("document_id")
+        response.analysis_result = "processing"
+        response.progress = meta.get("progress", 0)
+
+    return response
 
-    return response_data
+
+@router.websocket('/status/ws/{task_id}')
+async def task_status_ws(websocket: WebSocket, task_id: str):
+    """
+    Отправляет статус задачи (в формате GET /analyze/status/{task_id})
+    при каждом его изменении и закрывает соединение после SUCCESS/FAILURE
+    или через STATUS_WS_MAX_DURATION секунд.
+    """
+    await websocket.accept()
+
+    # The Celery Redis backend publishes every state update on the task's meta key
+    pubsub = websocket.app.state.redis.pubsub()
+    await pubsub.subscribe(celery_app.backend.get_key_for_task(task_id))
+
+    async def _push_updates():
+        last_frame = None
+        while True:
+            frame = (await get_task_status(task_id)).model_dump()
+            if frame != last_frame:
+                await websocket.send_json(frame)
+                last_frame = frame
+            if frame["task_status"] in TERMINAL_TASK_STATES:
+                return
+            # Wake up on the next published update, re-check anyway after a while
+            await pubsub.get_message(ignore_subscribe_messages=True, timeout=STATUS_RECHECK_INTERVAL)
+
+    async def _wait_for_disconnect():
+        # Clients never send anything, receive() only returns once they leave
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    pusher = asyncio.create_task(_push_updates())
+    watcher = asyncio.create_task(_wait_for_disconnect())
+    try:
+        done, _ = await asyncio.wait(
+            (pusher, watcher),
+            timeout=STATUS_WS_MAX_DURATION,
+            return_when=asyncio.FIRST_COMPLETED
+        )
+        if watcher not in done:
+            if pusher in done:
+                # Re-raise anything the pusher failed with
+                pusher.result()
+            # Task finished or the deadline passed
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        pusher.cancel()
+        watcher.cancel()
+        await asyncio.gather(pusher, watcher, return_exceptions=True)
+        await pubsub.aclose()
 
 
 @router.get('/document/{doc_id}/status', status_code=200,
@@ -111,7 +189,8 @@ async def get_task_status(
             response_model=DocumentAnalysisStatusResponse)
 async def get_document_status(
         doc_id: int = Path(..., ge=0, description="ID документа"),
-        db: AsyncSession = Depends(get_db)
+        db: AsyncSession = Depends(get_db),
+        redis: Redis = Depends(get_redis)
 ):
     """
     Проверяет статус анализа для конкретного документа.
@@ -122,46 +201,42 @@ async def get_document_status(
     - sample_issues: Примеры проблем (первые 3)
     """
     try:
-        # Check for existing analysis (single query with aggregation)
-        analysis_data = await db.execute(
-            select(
-                func.count(AnalyzedDocIssues.id).label('total_issues'),
-                func.array_agg(
-                    case(
-                        (AnalyzedDocIssues.severity == 'critical', 'CRITICAL: ' + AnalyzedDocIssues.issue),
-                        (AnalyzedDocIssues.severity == 'major', 'MAJOR: ' + AnalyzedDocIssues.issue),
-                        else_='MINOR: ' + AnalyzedDocIssues.issue
-                    )
-                ).label('formatted_issues')
-            )
+        if cached := await redis.get(document_status_key(doc_id)):
+            return DocumentAnalysisStatusResponse.model_validate_json(cached)
+
+        # Check for existing analysis: total count and the first 3 issues
+        # in one round-trip
+        total_issues = (
+            select(func.count())
+            .select_from(AnalyzedDocIssues)
             .where(AnalyzedDocIssues.document_id == doc_id)
+            .correlate(None)  # count the whole document, not the outer row
+            .scalar_subquery()
         )
-        result = analysis_data.first()
+        sample_rows = (await db.execute(
+            select(total_issues.label('total_issues'), AnalyzedDocIssues.severity, AnalyzedDocIssues.issue)
+            .where(AnalyzedDocIssues.document_id == doc_id)
+            .order_by(AnalyzedDocIssues.id)
+            .limit(3)
+        )).all()
 
-        if result and result.total_issues > 0:
-            return DocumentAnalysisStatusResponse(
+        if sample_rows:
+            response = DocumentAnalysisStatusResponse(
                 document_id=doc_id,
                 analyzed=True,
-                issues_count=result.total_issues,
+                issues_count=sample_rows[0].total_issues,
                 status="completed",
                 last_analyzed=None,  # Removed since model doesn't have created_at
-                sample_issues=result.formatted_issues[:3] if result.formatted_issues else None
+                sample_issues=[
+                    f"{SEVERITY_PREFIXES.get(row.severity, 'MINOR: ')}{row.issue}"
+                    for row in sample_rows
+                ]
             )
+            await redis.set(document_status_key(doc_id), response.model_dump_json(), ex=DOCUMENT_STATUS_TTL)
+            return response
 
-        # Check active Celery tasks
-        from app.celery_app import celery_app
-        inspector = celery_app.control.inspect()
-
-        is_being_analyzed = False
-        if active_tasks := inspector.active():
-            for worker_tasks in active_tasks.values():
-                for task in worker_tasks:
-                    task_args = task.get('args', [])
-                    task_kwargs = task.get('kwargs', {})
-                    if (isinstance(task_args, (list, tuple)) and len(task_args) > 0 and task_args[0] == doc_id) or \
-                            (isinstance(task_kwargs, dict) and task_kwargs.get('doc_id') == doc_id):
-                        is_being_analyzed = True
-                        break
+        # The running task keeps a marker key in Redis
+        is_being_analyzed = bool(await redis.exists(analyzing_key(doc_id)))
 
         return DocumentAnalysisStatusResponse(
             document_id=doc_id,
@@ -183,13 +258,56 @@ async def get_document_status(
         )
 
 
-@router.get('/result', status_code=200)
+@router.get('/result', status_code=200,
+            summary='Get analysis results page',
+            response_model=AnalysisResultPage)
 async def get_result(
         doc_id: int,
+        limit: Annotated[int, Query(ge=1, le=500)] = 100,
+        cursor: int | None = None,
         db: AsyncSession = Depends(get_db)
 ):
-    results = await db.scalars(
-        select(AnalyzedDocIssues)
+    """
+    Возвращает найденные проблемы постранично (keyset по id).
+    Для следующей страницы передайте next_cursor как cursor.
+    """
+    stmt = (
+        select(*ISSUE_COLUMNS)
         .where(AnalyzedDocIssues.document_id == doc_id)
+        .order_by(AnalyzedDocIssues.id)
+        .limit(limit)
     )
-    return results.all()
+    if cursor is not None:
+        stmt = stmt.where(AnalyzedDocIssues.id > cursor)
+
+    rows = (await db.execute(stmt)).all()
+    return AnalysisResultPage(
+        items=rows,
+        next_cursor=rows[-1].id if len(rows) == limit else None
+    )
+
+
+@router.get('/result/export', status_code=200, summary='Export all analysis results as NDJSON')
+async def export_result(doc_id: int):
+    """
+    Отдаёт все проблемы документа потоком NDJSON (одна проблема на строку),
+    не загружая их в память целиком.
+    """
+    async def _ndjson_rows():
+        # Own session: yield-dependencies are closed before the body is streamed
+        async with async_session_maker() as session:
+            result = await session.stream(
+                select(*ISSUE_COLUMNS)
+                .where(AnalyzedDocIssues.document_id == doc_id)
+                .order_by(AnalyzedDocIssues.id)
+                .execution_options(yield_per=500)
+            )
+            async for row in result:
+                yield orjson.dumps({
+                    "id": row.id,
+                    "document_id": row.document_id,
+                    "issue": row.issue,
+                    "severity": row.severity
+                }) + b"\n"
+
+    return StreamingResponse(_ndjson_rows(), media_type="application/x-ndjson")
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional, List
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 
 class AnalysisStatusResponse(BaseModel):
@@ -51,6 +51,8 @@ class TaskStatusResponse(BaseModel):
     document_id: Optional[int]
     analysis_result: Optional[str]  # completed, failed, in_progress
     issues_found: Optional[bool]
+    issues_count: Optional[int] = None
+    progress: float = 0  # 0-100
     error: Optional[str]
 
 class DocumentAnalysisStatusResponse(BaseModel):
@@ -59,4 +61,18 @@ class DocumentAnalysisStatusResponse(BaseModel):
     issues_count: int
     status: str  # not_analyzed, in_progress, completed
     last_analyzed: Optional[datetime]
-    sample_issues: Optional[List[str]]
\ No newline at end of file
+    sample_issues: Optional[List[str]]
+
+
+class AnalyzedIssue(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    document_id: int
+    issue: str
+    severity: str
+
+
+class AnalysisResultPage(BaseModel):
+    items: List[AnalyzedIssue]
+    next_cursor: Optional[int]  # pass as `cursor` to get the next page, None on the last one
@@ -1,3 +1,4 @@
+import orjson
 from ollama import Client, ChatResponse
 
 client = Client(host='http://host.docker.internal:11434')
@@ -19,3 +20,22 @@ chunk:
         ]
     )
     return response
+
+
+def parse_ollama_response(response_text: str) -> list[dict]:
+    """Issues reported in a model response, empty if none were found or the JSON is broken"""
+    # JSON object spans from the first '{' to the last '}'
+    start = response_text.find("{")
+    end = response_text.rfind("}")
+    if start == -1 or end < start:
+        return []
+
+    try:
+        parsed_json = orjson.loads(response_text[start:end + 1])
+    except orjson.JSONDecodeError as e:
+        print(f"JSON decode error: {e}")
+        return []
+
+    if parsed_json.get("status") == "issues_found":
+        return parsed_json.get('issues', [])
+    return []
@@ -1,22 +1,79 @@
 from app.celery_app import celery_app
 import httpx
-import re
-import json
 import asyncio
-from sqlalchemy import select, delete, insert, func
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from celery.signals import worker_process_init, worker_process_shutdown
+from sqlalchemy import select, delete, func, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.backend.client_dep import create_http_client
+from app.backend.db import engine, async_session_maker
+from app.backend.redis_dep import analyzing_key, analyzed_done_key, document_status_key, ANALYZED_DONE_TTL
 from app.config import settings
-from app.models.analyzed_doc import AnalyzedDocIssues
+from app.models.analyzed_doc import AnalyzedDocIssues, hash_issue
 from app.schemas.analyzer import DocumentAnalysisResponse
-from app.services.analyzer_service import analyze_chunk_with_ollama
+from app.services.analyzer_service import analyze_chunk_with_ollama, parse_ollama_response
+
+# Per worker process resources. One event loop lives as long as the worker
+# process, so the pooled connections of the HTTP client and of the database
+# engine are reused by every task instead of being rebuilt per task.
+worker_loop: asyncio.AbstractEventLoop | None = None
+http_client: httpx.AsyncClient | None = None
+ollama_executor: ThreadPoolExecutor | None = None
+
+# Model responses longer than this are parsed in the loop's default thread
+# executor so the event loop keeps serving the other in-flight chunks.
+# Prefork children are daemonic and may not start processes of their own.
+PARSE_OFF_LOOP_THRESHOLD = 64 * 1024
+
+# Deletes the analyzing marker only while it still names the calling task, so
+# a task finishing first doesn't clear the marker of an overlapping one
+RELEASE_ANALYZING_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+async def init_resources():
+    global http_client
+    http_client = create_http_client()
+
+
+async def close_resources():
+    await http_client.aclose()
+    await engine.dispose()
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    global worker_loop, ollama_executor
+    # Drop any pooled DB connections inherited from the parent process
+    engine.sync_engine.dispose(close=False)
+    worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(worker_loop)
+    worker_loop.run_until_complete(init_resources())
+    # The Ollama client is synchronous, its calls run in these threads
+    ollama_executor = ThreadPoolExecutor(
+        max_workers=settings.OLLAMA_CONCURRENCY,
+        thread_name_prefix="ollama"
+    )
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    if worker_loop is None:
+        return
+    worker_loop.run_until_complete(close_resources())
+    worker_loop.close()
+    ollama_executor.shutdown(wait=False, cancel_futures=True)
 
 
 @celery_app.task(bind=True, max_retries=3)
 def analyze_document_task(self, doc_id: int, language: str, retry: bool = False):
     async def _async_analyze():
-        print(f"Using database URL: {settings.DATABASE_URL}")
-        engine = create_async_engine(settings.DATABASE_URL)
-        async with AsyncSession(engine) as session:
+        async with async_session_maker() as session:
             try:
                 # Initialize result structure
                 result = {
@@ -30,129 +87,136 @@ def analyze_document_task(self, doc_id: int, language: str, retry: bool = False)
                 # Update initial progress
                 self.update_state(state='PROGRESS', meta=result)
 
-                # Check if document already exists
-                existing = await session.scalar(
-                    select(AnalyzedDocIssues)
-                    .where(AnalyzedDocIssues.document_id == doc_id)
-                    .limit(1)
-                )
+                # Short transaction so no connection is held while Ollama runs
+                async with session.begin():
+                    if retry:
+                        # Clear existing analysis
+                        await session.execute(
+                            delete(AnalyzedDocIssues)
+                            .where(AnalyzedDocIssues.document_id == doc_id)
+                        )
+                    else:
+                        # Check if document already exists
+                        existing = await session.execute(
+                            select(literal(1))
+                            .where(AnalyzedDocIssues.document_id == doc_id)
+                            .limit(1)
+                        )
 
-                if existing and not retry:
-                    result.update({
-                        "analysis_result": "exists",
-                        "progress": 100
-                    })
-                    return result
+                        if existing.first() is not None:
+                            result.update({
+                                "analysis_result": "exists",
+                                "progress": 100
+                            })
+                            return result
 
-                # Clear existing analysis if retry
                 if retry:
-                    await session.execute(
-                        delete(AnalyzedDocIssues)
-                        .where(AnalyzedDocIssues.document_id == doc_id)
-                    )
-                    await session.commit()
+                    # A status read between task start and the DELETE may have cached the old rows
+                    redis_client.delete(document_status_key(doc_id))
 
                 # Fetch document chunks
                 result.update({"progress": 25})
                 self.update_state(state='PROGRESS', meta=result)
 
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(
-                        f"{settings.DOCUMENT_SERVICE_URL}/api/documents/{doc_id}/chunks",
-                        timeout=30.0
-                    )
-                    response.raise_for_status()
-                    analysis_data = DocumentAnalysisResponse(**response.json())
+                response = await http_client.get(f"/api/documents/{doc_id}/chunks")
+                response.raise_for_status()
+                analysis_data = DocumentAnalysisResponse(**response.json())
+
+                # Process chunks concurrently, bounded by OLLAMA_CONCURRENCY
+                total_chunks = len(analysis_data.chunks)
+                semaphore = asyncio.Semaphore(settings.OLLAMA_CONCURRENCY)
+                processed_chunks = 0
+
+                async def _analyze_chunk(chunk) -> list:
+                    nonlocal processed_chunks
+                    loop = asyncio.get_running_loop()
+                    async with semaphore:
+                        ollama_response = await loop.run_in_executor(
+                            ollama_executor,
+                            partial(analyze_chunk_with_ollama, chunk.text, language=language)
+                        )
+                        response_text = ollama_response["message"]["content"]
 
-                    # Process chunks
-                    issues_found = []
-                    total_chunks = len(analysis_data.chunks)
+                        if len(response_text) > PARSE_OFF_LOOP_THRESHOLD:
+                            chunk_issues = await loop.run_in_executor(
+                                None, parse_ollama_response, response_text
+                            )
+                        else:
+                            chunk_issues = parse_ollama_response(response_text)
 
-                    for i, chunk in enumerate(analysis_data.chunks, 1):
                         # Update chunk processing progress
-                        chunk_progress = 25 + (i / total_chunks) * 75
+                        processed_chunks += 1
                         result.update({
-                            "progress": chunk_progress,
-                            "current_chunk": i,
+                            "progress": 25 + (processed_chunks / total_chunks) * 75,
+                            "current_chunk": processed_chunks,
                             "total_chunks": total_chunks
                         })
                         self.update_state(state='PROGRESS', meta=result)
+                        return chunk_issues
 
-                        # Analyze chunk
-                        ollama_response = analyze_chunk_with_ollama(
-                            chunk.text,
-                            language=language
-                        )
-                        response_text = ollama_response["message"]["content"]
-
-                        if match := re.search(r"\{.*}", response_text, re.DOTALL):
-                            try:
-                                parsed_json = json.loads(match.group())
-                                if parsed_json.get("status") == "issues_found":
-                                    issues_found.extend(parsed_json.get('issues', []))
-                            except json.JSONDecodeError as e:
-                                print(f"JSON decode error: {e}")
+                # A failing chunk cancels the rest instead of leaving them running
+                async with asyncio.TaskGroup() as chunk_group:
+                    chunk_tasks = [
+                        chunk_group.create_task(_analyze_chunk(chunk))
+                        for chunk in analysis_data.chunks
+                    ]
+                issues_found = [issue for chunk_task in chunk_tasks for issue in chunk_task.result()]
 
-                    # Prepare final result
-                    if issues_found:
-                        result.update({
-                            "analysis_result": "completed_with_issues_but_not_inserted",
-                            "issues_found": issues_found,
-                            "progress": 90
-                        })
-                    else:
-                        result.update({
-                            "analysis_result": "completed_no_issues",
-                            "progress": 100
-                        })
+                # Prepare final result
+                if issues_found:
+                    result.update({
+                        "analysis_result": "completed_with_issues_but_not_inserted",
+                        "issues_found": issues_found,
+                        "progress": 90
+                    })
+                else:
+                    result.update({
+                        "analysis_result": "completed_no_issues",
+                        "progress": 100
+                    })
 
-                    # Insert found issues
-                    # Modify your insertion block like this:
-                    if issues_found:
-                        try:
-                            await session.execute(
-                                insert(AnalyzedDocIssues),
-                                [
+                # Insert found issues with a single multi-row INSERT,
+                # findings already stored for the document are skipped
+                if issues_found:
+                    try:
+                        async with session.begin():
+                            inserted = await session.execute(
+                                pg_insert(AnalyzedDocIssues).values([
                                     {
                                         "document_id": doc_id,
                                         "issue": issue["text"],
+                                        "issue_hash": hash_issue(issue["text"]),
                                         "severity": issue["severity"]
                                     }
                                     for issue in issues_found
-                                ]
+                                ])
+                                .on_conflict_do_nothing(constraint='uq_doc_issue')
+                                .returning(AnalyzedDocIssues.id)
                             )
-                            await session.commit()
-                            print(f"Successfully committed issues for document {doc_id}")
-
-                            # Verify insertion
-                            inserted_count = await session.scalar(
-                                select(func.count(AnalyzedDocIssues.id)).where(
-                                    AnalyzedDocIssues.document_id == doc_id
-                                )
+                            inserted_count = len(inserted.all())
+                            # A concurrent task may have stored the same findings first,
+                            # so report what the document holds, not just our own rows
+                            stored_count = await session.scalar(
+                                select(func.count())
+                                .select_from(AnalyzedDocIssues)
+                                .where(AnalyzedDocIssues.document_id == doc_id)
                             )
-                            print(f"Verification found {inserted_count} inserted records")
-
-                            if inserted_count >= len(issues_found):
-                                result.update({
-                                    "progress": 100,
-                                    "analysis_result": "completed_with_issues",
-                                    "inserted_issues": inserted_count
-                                })
-                            else:
-                                result.update({
-                                    "analysis_result": "completed_with_issues_but_insert_failed",
-                                    "expected_issues": len(issues_found),
-                                    "inserted_issues": inserted_count
-                                })
-                        except Exception as e:
-                            print(f"Insertion failed: {str(e)}")
-                            await session.rollback()
-                            result.update({
-                                "analysis_result": "completed_with_issues_but_insert_failed",
-                                "error": str(e)
-                            })
+                        print(f"Successfully committed {inserted_count} issues for document {doc_id}")
+
+                        result.update({
+                            "progress": 100,
+                            "analysis_result": "completed_with_issues",
+                            "inserted_issues": inserted_count,
+                            "stored_issues": stored_count
+                        })
+                    except Exception as e:
+                        print(f"Insertion failed: {str(e)}")
+                        result.update({
+                            "analysis_result": "completed_with_issues_but_insert_failed",
+                            "error": str(e)
+                        })
 
-                    return result
+                return result
 
             except Exception as e:
                 # Format exception properly for Celery
@@ -163,11 +227,32 @@ def analyze_document_task(self, doc_id: int, language: str, retry: bool = False)
                     "analysis_result": "failed",
                     "progress": 100
                 }
-            finally:
-                await engine.dispose()
+
+    redis_client = celery_app.backend.client
+
+    # Recently finished documents are answered without touching the database
+    if retry:
+        redis_client.delete(analyzed_done_key(doc_id), document_status_key(doc_id))
+    elif redis_client.exists(analyzed_done_key(doc_id)):
+        return {
+            "document_id": doc_id,
+            "analysis_result": "exists",
+            "issues_found": None,
+            "error": None,
+            "progress": 100
+        }
+
+    # Lets the API report "in_progress" without broadcasting to workers.
+    # Expires with the hard time limit in case the worker dies mid-task.
+    redis_client.set(analyzing_key(doc_id), self.request.id, ex=celery_app.conf.task_time_limit)
 
     try:
-        result = asyncio.run(_async_analyze())
+        # The solo pool doesn't fire worker_process_init. Only solo and prefork
+        # are supported: threads/gevent/eventlet pools would run tasks
+        # concurrently on this one shared loop, which raises RuntimeError.
+        if worker_loop is None:
+            init_worker_process()
+        result = worker_loop.run_until_complete(_async_analyze())
 
         # Handle explicit failure cases
         if isinstance(result, dict) and result.get("analysis_result") == "failed":
@@ -175,6 +260,9 @@ def analyze_document_task(self, doc_id: int, language: str, retry: bool = False)
             return result
 
         # Successful completion
+        if result.get("analysis_result") in ("completed_with_issues", "exists"):
+            redis_client.set(analyzed_done_key(doc_id), 1, ex=ANALYZED_DONE_TTL)
+
         self.update_state(state='SUCCESS', meta=result)
         return result
 
@@ -192,3 +280,7 @@ def analyze_document_task(self, doc_id: int, language: str, retry: bool = False)
 
         self.update_state(state='FAILURE', meta=error_result)
         raise self.retry(exc=e) if retry else e
+    finally:
+        redis_client.eval(RELEASE_ANALYZING_SCRIPT, 1, analyzing_key(doc_id), self.request.id)
+        # Whatever the outcome, the cached document status no longer holds
+        redis_client.delete(document_status_key(doc_id))
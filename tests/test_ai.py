@@ -1,51 +1,142 @@
+import asyncio
+import itertools
+import json
+import os
+
 import pytest
+import pytest_asyncio
 import httpx
-import random
-import time
-from typing import Dict, Any
-
-BASE_URL = "http://127.0.0.1:4000"
 
+try:
+    import websockets
+    WS_AVAILABLE = True
+except ImportError:
+    WS_AVAILABLE = False
 
-def wait_for_ollama_analysis_completion(client, task_id, max_wait=120, poll_interval=2):
-    """Poll task status until Ollama analysis completes or timeout"""
-    wait_time = 0
+BASE_URL = "http://127.0.0.1:4000"
+WS_URL = "ws://127.0.0.1:4000"
+
+# Documents 1..10 exist in the document service, NONEXISTENT_DOC_ID never does.
+# Ids are handed out in a fixed order (see doc_id_seq), so a rerun of a failed
+# run requests the same documents and "not found" tests never hit an analyzed one
+KNOWN_DOC_IDS = range(1, 11)
+NONEXISTENT_DOC_ID = 9_999_999
+
+TERMINAL_STATES = frozenset({"SUCCESS", "FAILURE"})
+# Anything a freshly started task can report, up to and including its end
+VALID_START_STATES = frozenset({"PENDING", "STARTED", "PROGRESS", "SUCCESS", "FAILURE"})
+DOCUMENT_STATUSES = frozenset({"not_analyzed", "in_progress", "completed"})
+
+# Tests share one event loop so they can share the session-scoped client
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+class OllamaTimeout(Exception):
+    """Ollama analysis did not finish in time, callers decide whether to skip"""
+
+
+def fail_on_task_failure(status_data):
+    """Fail the test if the task status reports a failed Ollama analysis"""
+    if status_data["task_status"] == "FAILURE":
+        # Handle different error formats from Celery
+        error_msg = status_data.get('error', 'Unknown error')
+        if isinstance(error_msg, dict):
+            error_msg = error_msg.get('exc_message', str(error_msg))
+        pytest.fail(f"Ollama analysis failed: {error_msg}")
+
+
+def poll_schedule(first=0.05, factor=1.5, cap=1.0):
+    """Delays between status polls: start fast, back off up to `cap` seconds"""
+    delay = first
+    while True:
+        yield delay
+        delay = min(delay * factor, cap)
+
+
+async def wait_for_ollama_analysis_completion(client, task_id, max_wait=120):
+    """Wait for task status pushes (or poll without websockets) until Ollama analysis completes or timeout"""
+    def check(status_data):
+        if status_data["task_status"] in TERMINAL_STATES:
+            fail_on_task_failure(status_data)
+            return True
+        print(f"Ollama analysis in progress... Status: {status_data['task_status']}, "
+              f"Progress: {status_data.get('progress', 0)}%")
+        return False
+
+    async def _receive_until_done():
+        async with websockets.connect(f"{WS_URL}/analyze/status/ws/{task_id}") as ws:
+            async for frame in ws:
+                status_data = json.loads(frame)
+                if check(status_data):
+                    return status_data
+
+    async def _poll_until_done():
+        delays = poll_schedule()
+        while True:
+            status_response = await client.get(f"/analyze/status/{task_id}")
+            assert status_response.status_code == 200
+            status_data = status_response.json()
+            if check(status_data):
+                return status_data
+            await asyncio.sleep(next(delays))
+
+    wait = _receive_until_done if WS_AVAILABLE else _poll_until_done
+    try:
+        return await asyncio.wait_for(wait(), timeout=max_wait)
+    except asyncio.TimeoutError:
+        raise OllamaTimeout(f"Ollama analysis did not complete within {max_wait} seconds") from None
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def client():
+    """One pooled client for the whole run, tests only read from the API"""
+    # retries=1 re-dials once on a refused/reset connect; pool limits are set on the transport
+    transport = httpx.AsyncHTTPTransport(
+        retries=1,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60.0),
+    )
+    async with httpx.AsyncClient(
+            base_url=BASE_URL,
+            transport=transport,
+            timeout=httpx.Timeout(10.0, connect=2.0)
+    ) as c:
+        yield c
 
-    while wait_time < max_wait:
-        status_response = client.get(f"/analyze/status/{task_id}")
-        assert status_response.status_code == 200
-        status_data = status_response.json()
 
-        if status_data["task_status"] == "SUCCESS":
-            return status_data
-        elif status_data["task_status"] == "FAILURE":
-            # Handle different error formats from Celery
-            error_msg = status_data.get('error', 'Unknown error')
-            if isinstance(error_msg, dict):
-                error_msg = error_msg.get('exc_message', str(error_msg))
-            pytest.fail(f"Ollama analysis failed: {error_msg}")
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def openapi_schema(client):
+    """The service's OpenAPI document, fetched and parsed once per run"""
+    try:
+        response = await client.get("/openapi.json", timeout=2.0)
+    except httpx.TransportError:
+        pytest.skip(f"Service unavailable at {BASE_URL}")
+    assert response.status_code == 200
+    return response.json()
 
-        print(
-            f"Ollama analysis in progress... Status: {status_data['task_status']}, Progress: {status_data.get('progress', 0)}%")
-        time.sleep(poll_interval)
-        wait_time += poll_interval
 
-    pytest.fail(f"Ollama analysis did not complete within {max_wait} seconds")
+@pytest_asyncio.fixture(scope="session", loop_scope="session", autouse=True)
+async def _require_service(openapi_schema):
+    """Skip every test up front when the API is not reachable"""
+    assert "paths" in openapi_schema
 
 
-@pytest.fixture
-def client():
-    with httpx.Client(base_url=BASE_URL) as c:
-        yield c
+@pytest.fixture(scope="session")
+def doc_id_seq():
+    """Deterministic document ids, each xdist worker cycles through its own share"""
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "gw0")
+    workers = int(os.environ.get("PYTEST_XDIST_WORKER_COUNT", "1"))
+    # With more workers than documents, the extra workers wrap around and share one
+    start = int(worker.removeprefix("gw")) % len(KNOWN_DOC_IDS)
+    return itertools.cycle(KNOWN_DOC_IDS[start::workers])
 
 
-@pytest.fixture
-def ollama_analyzed_document(client):
-    """Fixture that provides a document analyzed by Ollama"""
-    doc_id = random.randint(1, 10)
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def ollama_analyzed_document(client, doc_id_seq):
+    """Fixture that provides a document analyzed by Ollama, once per run"""
+    doc_id = next(doc_id_seq)
 
     # Start Ollama analysis
-    start_response = client.post(
+    start_response = await client.post(
         f"/analyze/{doc_id}",
         params={"language": "en"}
     )
@@ -54,7 +145,10 @@ def ollama_analyzed_document(client):
     task_id = task_data["task_id"]
 
     # Wait for Ollama analysis completion
-    task_result = wait_for_ollama_analysis_completion(client, task_id)
+    try:
+        task_result = await wait_for_ollama_analysis_completion(client, task_id)
+    except OllamaTimeout:
+        pytest.skip("Ollama analysis taking too long - skipping")
 
     return {
         "doc_id": doc_id,
@@ -63,12 +157,12 @@ def ollama_analyzed_document(client):
     }
 
 
-def test_ollama_analysis_lifecycle(client):
+async def test_ollama_analysis_lifecycle(client, doc_id_seq):
     """Test the complete Ollama analysis lifecycle with polling"""
-    doc_id = random.randint(1, 10)
+    doc_id = next(doc_id_seq)
 
     # Start Ollama analysis
-    start_response = client.post(
+    start_response = await client.post(
         f"/analyze/{doc_id}",
         params={"language": "en"}
     )
@@ -76,114 +170,78 @@ def test_ollama_analysis_lifecycle(client):
     task_data = start_response.json()
     task_id = task_data["task_id"]
 
+    # Both checks only need task_id, send them concurrently
+    status_response, doc_status_response = await asyncio.gather(
+        client.get(f"/analyze/status/{task_id}"),
+        client.get(f"/analyze/document/{doc_id}/status"),
+    )
+    assert status_response.status_code == 200
+    assert status_response.json()["task_id"] == task_id
+    assert status_response.json()["task_status"] in VALID_START_STATES
+    assert doc_status_response.status_code == 200
+    assert doc_status_response.json()["status"] in DOCUMENT_STATUSES
+
     try:
         # Poll for Ollama completion with shorter timeout for CI
-        final_status = wait_for_ollama_analysis_completion(client, task_id, max_wait=30)
-
-        # Verify final result structure
-        assert final_status["task_status"] == "SUCCESS"
-        assert final_status["document_id"] == doc_id
+        final_status = await wait_for_ollama_analysis_completion(client, task_id, max_wait=30)
+    except OllamaTimeout:
+        pytest.skip("Ollama analysis taking too long - skipping")
 
+    # Verify final result structure
+    assert final_status["task_status"] == "SUCCESS"
+    assert final_status["document_id"] == doc_id
 
-    except Exception as e:
-        if "Ollama analysis did not complete" in str(e):
-            pytest.skip("Ollama analysis taking too long - skipping")
-        else:
-            raise
 
-
-def test_ollama_analysis_with_different_languages(client):
+@pytest.mark.slow
+@pytest.mark.parametrize("language", ["en", "ru"])
+async def test_ollama_analysis_with_different_languages(client, doc_id_seq, language):
     """Test Ollama analysis with different supported languages"""
-    languages = ["en", "ru"]
+    doc_id = next(doc_id_seq)
 
-    for language in languages:
-        doc_id = random.randint(1, 10)
+    response = await client.post(f"/analyze/{doc_id}", params={"language": language})
+    assert response.status_code == 202
 
-        response = client.post(
-            f"/analyze/{doc_id}",
-            params={"language": language}
-        )
-        assert response.status_code == 202
-        task_data = response.json()
+    try:
+        # Wait for Ollama completion to ensure language parameter works
+        task_result = await wait_for_ollama_analysis_completion(client, response.json()["task_id"], max_wait=30)
+    except OllamaTimeout:
+        pytest.skip("Ollama analysis taking too long - skipping")
 
-        try:
-            # Wait for Ollama completion to ensure language parameter works
-            task_result = wait_for_ollama_analysis_completion(client, task_data["task_id"], max_wait=30)
-            assert task_result["task_status"] == "SUCCESS"
-        except Exception as e:
-            if "Ollama analysis did not complete" in str(e):
-                pytest.skip(f"Ollama analysis for {language} taking too long - skipping")
-            else:
-                raise
+    assert task_result["task_status"] == "SUCCESS"
 
 
-def test_ollama_analysis_results_after_completion(client):
+async def test_ollama_analysis_results_after_completion(client, ollama_analyzed_document):
     """Test retrieving Ollama analysis results after completion"""
-    # Skip this test if we can't get a completed analysis
-    doc_id = random.randint(1, 10)
+    doc_id = ollama_analyzed_document["doc_id"]
 
-    # Start analysis but don't wait for completion in fixture
-    start_response = client.post(
-        f"/analyze/{doc_id}",
-        params={"language": "en"}
-    )
-    assert start_response.status_code == 202
-
-    # For this test, just verify we can query results endpoint
-    response = client.get("/analyze/result", params={"doc_id": doc_id})
+    response = await client.get("/analyze/result", params={"doc_id": doc_id})
     assert response.status_code == 200
     results = response.json()
 
-    # Results should be a list (could be empty if no issues found by Ollama or analysis not complete)
-    assert isinstance(results, list)
+    # Items should be a list (could be empty if no issues found by Ollama)
+    assert isinstance(results["items"], list)
+    assert "next_cursor" in results
+    for item in results["items"]:
+        assert item["document_id"] == doc_id
 
 
-def test_ollama_analysis_with_retry(client):
-    """Test retry Ollama analysis on already analyzed document"""
-    doc_id = random.randint(1, 10)
-
-    # First Ollama analysis
-    first_response = client.post(
-        f"/analyze/{doc_id}",
-        params={"language": "en"}
-    )
-    assert first_response.status_code == 202
-
-    # Just test that the retry endpoint accepts the request
-    retry_response = client.post(
-        f"/analyze/{doc_id}",
-        params={"language": "en", "retry": True}
-    )
-    assert retry_response.status_code == 202
-
-
-def test_ollama_progress_tracking_during_analysis(client):
+async def test_ollama_progress_tracking_during_analysis(client, doc_id_seq):
     """Test that progress is properly tracked during Ollama analysis"""
-    doc_id = random.randint(1, 10)
+    doc_id = next(doc_id_seq)
 
-    # Start Ollama analysis
-    start_response = client.post(
+    # retry re-runs the analysis even if the document was analyzed before,
+    # otherwise the "exists" fast path can finish before the first frame
+    start_response = await client.post(
         f"/analyze/{doc_id}",
-        params={"language": "en"}
+        params={"language": "en", "retry": True}
     )
     task_id = start_response.json()["task_id"]
 
-    # Track progress through a few polls (don't wait for full completion)
+    # Track progress for a few seconds (don't wait for full completion)
     progress_values = []
-    max_wait = 10  # Only poll for 10 seconds
-    wait_time = 0
-    poll_interval = 1
-
-    while wait_time < max_wait:
-        status_response = client.get(f"/analyze/status/{task_id}")
-        status_data = status_response.json()
-
-        if status_data["task_status"] == "SUCCESS":
-            break
-        elif status_data["task_status"] == "FAILURE":
-            # Don't fail the test, just skip if analysis fails
-            pytest.skip("Ollama analysis failed during progress tracking")
+    max_wait = 10
 
+    def record_progress(status_data):
         progress = status_data.get("progress", 0)
         progress_values.append(progress)
 
@@ -191,47 +249,80 @@ def test_ollama_progress_tracking_during_analysis(client):
         assert 0 <= progress <= 100
 
         print(f"Ollama analysis progress: {progress}%")
-        time.sleep(poll_interval)
-        wait_time += poll_interval
+
+    if WS_AVAILABLE:
+        async def _collect_progress():
+            async with websockets.connect(f"{WS_URL}/analyze/status/ws/{task_id}") as ws:
+                async for frame in ws:
+                    status_data = json.loads(frame)
+                    if status_data["task_status"] == "FAILURE":
+                        # Don't fail the test, just skip if analysis fails
+                        pytest.skip("Ollama analysis failed during progress tracking")
+                    # A task that is already done reports its final progress
+                    record_progress(status_data)
+                    if status_data["task_status"] == "SUCCESS":
+                        break
+    else:
+        async def _collect_progress():
+            delays = poll_schedule()
+            while True:
+                status_response = await client.get(f"/analyze/status/{task_id}")
+                status_data = status_response.json()
+
+                if status_data["task_status"] == "FAILURE":
+                    # Don't fail the test, just skip if analysis fails
+                    pytest.skip("Ollama analysis failed during progress tracking")
+
+                # A task that is already done reports its final progress
+                record_progress(status_data)
+                if status_data["task_status"] == "SUCCESS":
+                    break
+                await asyncio.sleep(next(delays))
+
+    try:
+        await asyncio.wait_for(_collect_progress(), timeout=max_wait)
+    except asyncio.TimeoutError:
+        pass
 
     # At least we got some progress data
     assert len(progress_values) > 0
 
 
-def test_concurrent_ollama_analyses(client):
+async def test_concurrent_ollama_analyses(client, doc_id_seq):
     """Test multiple concurrent Ollama analysis requests"""
-    doc_ids = [random.randint(1, 10) for _ in range(2)]
-    task_ids = []
+    doc_ids = [next(doc_id_seq) for _ in range(2)]
 
     # Start all Ollama analyses
-    for doc_id in doc_ids:
-        response = client.post(
-            f"/analyze/{doc_id}",
-            params={"language": "en"}
-        )
+    responses = await asyncio.gather(*(
+        client.post(f"/analyze/{doc_id}", params={"language": "en"})
+        for doc_id in doc_ids
+    ))
+    for response in responses:
         assert response.status_code == 202
-        task_ids.append(response.json()["task_id"])
+    task_ids = [response.json()["task_id"] for response in responses]
 
     # Verify we can check status for all tasks (don't wait for completion)
-    for task_id in task_ids:
-        response = client.get(f"/analyze/status/{task_id}")
+    status_responses = await asyncio.gather(*(
+        client.get(f"/analyze/status/{task_id}") for task_id in task_ids
+    ))
+    for response in status_responses:
         assert response.status_code == 200
         status_data = response.json()
-        assert "task_status" in status_data
+        assert status_data["task_status"] in VALID_START_STATES
 
 
-# Keep all the non-Ollama tests the same as before
-def test_app_health(client):
-    """Test that the API is running and accessible"""
-    response = client.get("/openapi.json")
-    assert response.status_code == 200
+async def test_openapi_documents_language_enum(openapi_schema):
+    """Test that the language parameter still advertises its allowed values"""
+    parameters = openapi_schema["paths"]["/analyze/{doc_id}"]["post"]["parameters"]
+    language = next(p for p in parameters if p["name"] == "language")
+    assert sorted(language["schema"]["enum"]) == ["en", "ru"]
 
 
-def test_analyze_document_endpoint(client):
+async def test_analyze_document_endpoint(client, doc_id_seq):
     """Test starting document analysis"""
-    doc_id = random.randint(1, 10)
+    doc_id = next(doc_id_seq)
 
-    response = client.post(
+    response = await client.post(
         f"/analyze/{doc_id}",
         params={"language": "en"}
     )
@@ -243,11 +334,19 @@ def test_analyze_document_endpoint(client):
     assert "task_id" in body
 
 
-def test_analyze_document_with_retry(client):
-    """Test document analysis with retry flag"""
-    doc_id = random.randint(1, 10)
+async def test_analyze_document_with_retry(client, doc_id_seq):
+    """Test retry analysis on an already requested document"""
+    doc_id = next(doc_id_seq)
 
-    response = client.post(
+    # First analysis
+    first_response = await client.post(
+        f"/analyze/{doc_id}",
+        params={"language": "en"}
+    )
+    assert first_response.status_code == 202
+
+    # Retry is accepted and reported like a regular start
+    response = await client.post(
         f"/analyze/{doc_id}",
         params={"language": "ru", "retry": True}
     )
@@ -258,87 +357,108 @@ def test_analyze_document_with_retry(client):
     assert body["document_id"] == doc_id
 
 
-def test_analyze_document_invalid_language(client):
+async def test_analyze_document_invalid_language(client):
     """Test analysis with invalid language parameter"""
-    doc_id = random.randint(1000, 10000)
-
-    response = client.post(
-        f"/analyze/{doc_id}",
-        params={"language": "invalid"}
-    )
+    doc_id = NONEXISTENT_DOC_ID
 
-    # Should return validation error
-    assert response.status_code == 422
+    # Only the status matters, so the error body is never read
+    async with client.stream("POST", f"/analyze/{doc_id}", params={"language": "invalid"}) as response:
+        # Should return validation error
+        assert response.status_code == 422
 
 
-def test_analyze_document_negative_id(client):
+async def test_analyze_document_negative_id(client):
     """Test analysis with negative document ID"""
-    response = client.post(
-        "/analyze/-1",
-        params={"language": "en"}
-    )
-
-    # Should return validation error
-    assert response.status_code == 422
+    async with client.stream("POST", "/analyze/-1", params={"language": "en"}) as response:
+        # Should return validation error
+        assert response.status_code == 422
 
 
-def test_get_task_status_invalid_task(client):
+async def test_get_task_status_invalid_task(client):
     """Test getting status for non-existent task"""
-    response = client.get("/analyze/status/invalid-task-id")
+    response = await client.get("/analyze/status/invalid-task-id")
 
     assert response.status_code == 200
     body = response.json()
     assert body["task_id"] == "invalid-task-id"
-    assert body["task_status"] in ["PENDING", "FAILURE"]
+    assert body["task_status"] in {"PENDING", "FAILURE"}
     assert body["analysis_result"] is None
 
 
-def test_get_document_status_non_existent(client):
+@pytest.mark.skipif(not WS_AVAILABLE, reason="websockets is not installed")
+async def test_task_status_websocket_sends_current_state():
+    """Test that the status websocket pushes the current state right after connecting"""
+    async with websockets.connect(f"{WS_URL}/analyze/status/ws/invalid-task-id") as ws:
+        frame = await asyncio.wait_for(ws.recv(), timeout=5)
+
+    status_data = json.loads(frame)
+    assert status_data["task_id"] == "invalid-task-id"
+    assert status_data["task_status"] == "PENDING"
+
+
+async def test_get_document_status_non_existent(client):
     """Test getting status for non-existent document"""
-    doc_id = random.randint(10000, 20000)  # Use high ID that likely doesn't exist
+    doc_id = NONEXISTENT_DOC_ID
 
-    response = client.get(f"/analyze/document/{doc_id}/status")
+    response = await client.get(f"/analyze/document/{doc_id}/status")
 
     assert response.status_code == 200
     body = response.json()
     assert body["document_id"] == doc_id
     assert body["analyzed"] is False
     assert body["issues_count"] == 0
-    assert body["status"] in ["not_analyzed", "in_progress"]
+    assert body["status"] in {"not_analyzed", "in_progress"}
     assert body["sample_issues"] is None
 
 
-def test_get_analysis_results_non_existent(client):
+async def test_get_analysis_results_non_existent(client):
     """Test getting analysis results for non-existent document"""
-    doc_id = random.randint(10000, 20000)
+    doc_id = NONEXISTENT_DOC_ID
 
-    response = client.get("/analyze/result", params={"doc_id": doc_id})
+    response = await client.get("/analyze/result", params={"doc_id": doc_id})
 
     assert response.status_code == 200
     body = response.json()
-    assert body == []  # Empty list when no results
+    assert body == {"items": [], "next_cursor": None}  # Empty page when no results
 
 
-def test_error_handling_invalid_endpoints(client):
+async def test_get_analysis_results_limit_validation(client):
+    """Test that the results page size is bounded"""
+    response = await client.get("/analyze/result", params={"doc_id": 1, "limit": 501})
+    assert response.status_code == 422
+
+
+async def test_export_analysis_results_non_existent(client):
+    """Test NDJSON export for non-existent document"""
+    doc_id = NONEXISTENT_DOC_ID
+
+    response = await client.get("/analyze/result/export", params={"doc_id": doc_id})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.text == ""
+
+
+async def test_error_handling_invalid_endpoints(client):
     """Test error handling for invalid endpoints"""
     # Test GET on endpoint that only supports POST
-    response = client.get("/analyze/123")
-    assert response.status_code == 405  # Method Not Allowed
+    async with client.stream("GET", "/analyze/123") as response:
+        assert response.status_code == 405  # Method Not Allowed
 
     # Test invalid endpoint
-    response = client.get("/analyze/invalid-endpoint/not-real")
-    assert response.status_code == 404
+    async with client.stream("GET", "/analyze/invalid-endpoint/not-real") as response:
+        assert response.status_code == 404
 
 
-def test_cors_headers(client):
+async def test_cors_headers(client):
     """Test that CORS headers are properly set"""
     # Test OPTIONS preflight request
-    response = client.options("/analyze/123")
-    # OPTIONS might return 405 if not explicitly handled, but CORS headers should still be present
-    if response.status_code == 200:
-        assert "access-control-allow-origin" in response.headers
-    elif response.status_code == 405:
-        # Method not allowed, but CORS headers might still be set
-        pass
+    async with client.stream("OPTIONS", "/analyze/123") as response:
+        # OPTIONS might return 405 if not explicitly handled, but CORS headers should still be present
+        if response.status_code == 200:
+            assert "access-control-allow-origin" in response.headers
+        elif response.status_code == 405:
+            # Method not allowed, but CORS headers might still be set
+            pass
 
 # Remove the slow-marked test since it's causing issues
\ No newline at end of file